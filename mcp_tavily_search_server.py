@@ -1,8 +1,12 @@
 from mcp.server.fastmcp import FastMCP
 from tavily import TavilyClient
 import os
-import requests
+import re
+import asyncio
+import httpx
+from cachetools import TTLCache
 from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -14,6 +18,46 @@ mcp = FastMCP("web-search")
 tavily_key = os.getenv("TAVILY_API_KEY")
 tavily = TavilyClient(api_key=tavily_key) if tavily_key else None
 
+# Shared HTTP client so repeated page visits reuse pooled keep-alive connections
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+    timeout=30.0,
+    follow_redirects=True,
+    http2=True,
+)
+
+# Cleaned page text keyed by canonical URL, stored as (etag, last_modified, text)
+page_cache = TTLCache(maxsize=512, ttl=3600)
+page_cache_lock = asyncio.Lock()
+
+def _canonical_url(url):
+    # httpx lowercases scheme/host; fragments never reach the server
+    return str(httpx.URL(url).copy_with(fragment=None))
+
+# Line breaks (as recognised by str.splitlines) and runs of 2+ spaces (plus surrounding whitespace) delimit text chunks
+_WS_RE = re.compile(r"\s*(?:[\r\n\v\f\x1c-\x1e\x85\u2028\u2029]|  )\s*")
+
+def _extract_text(html):
+    """Strip scripts/styles from an HTML document and return its cleaned text."""
+    try:
+        # selectolax (lexbor) is much faster than building a BeautifulSoup tree
+        tree = LexborHTMLParser(html)
+        for node in tree.css("script, style"):
+            node.decompose()
+        text = tree.text(separator='\n')
+    except Exception:
+        # Fall back to BeautifulSoup (lxml backend)
+        soup = BeautifulSoup(html, 'lxml')
+
+        # Remove script and style elements
+        for script_or_style in soup(["script", "style"]):
+            script_or_style.decompose()
+
+        text = soup.get_text(separator='\n')
+
+    # Clean up whitespace
+    return _WS_RE.sub('\n', text).strip()
+
 @mcp.tool()
 async def search_web(query: str, num_results: int = 5):
     """
@@ -21,13 +65,15 @@ async def search_web(query: str, num_results: int = 5):
     Returns relevant snippets and content automatically.
     """
     if not tavily:
-        return "Error: TAVILY_API_KEY not found in environment."
+        return "TOOL ERROR: TAVILY_API_KEY not found in environment."
 
     try:
         print(f"Searching Tavily for: {query}")
         
         # 'search_depth="advanced"' does a deeper search and extraction
-        response = tavily.search(
+        # TavilyClient is synchronous, so run it in a worker thread
+        response = await asyncio.to_thread(
+            tavily.search,
             query=query, 
             search_depth="advanced", 
             max_results=num_results,
@@ -64,27 +110,47 @@ async def visit_page(url: str):
     try:
         print(f"Visiting URL: {url}")
         
-        # requests handles redirection by default
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        
-        # Use BeautifulSoup to extract text
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Remove script and style elements
-        for script_or_style in soup(["script", "style"]):
-            script_or_style.decompose()
-            
-        # Get text and clean up whitespace
-        text = soup.get_text(separator='\n')
-        lines = (line.strip() for line in text.splitlines())
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        clean_text = '\n'.join(chunk for chunk in chunks if chunk)
+        key = _canonical_url(url)
+        async with page_cache_lock:
+            cached = page_cache.get(key)
+
+        # Revalidate cached pages with the origin; without validators serve the cached copy
+        etag, last_modified, headers = None, None, {}
+        if cached:
+            etag, last_modified, cached_text = cached
+            if not etag and not last_modified:
+                return f"=== CONTENT OF {url} ===\n\n{cached_text}"
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        response = await http_client.get(url, headers=headers)
+        if cached and response.status_code == 304:
+            # Not modified: reuse the cached text, keeping old validators unless new ones were sent
+            clean_text = cached_text
+            etag = response.headers.get("ETag", etag)
+            last_modified = response.headers.get("Last-Modified", last_modified)
+        else:
+            response.raise_for_status()
+            # Parsing is CPU-bound, run it off the event loop
+            clean_text = await asyncio.to_thread(_extract_text, response.text)
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+
+        async with page_cache_lock:
+            page_cache[key] = (etag, last_modified, clean_text)
         
         return f"=== CONTENT OF {url} ===\n\n{clean_text}"
 
     except Exception as e:
         return f"TOOL ERROR: {str(e)}"
 
+async def main():
+    try:
+        await mcp.run_sse_async()
+    finally:
+        await http_client.aclose()
+
 if __name__ == "__main__":
-    mcp.run(transport="sse")
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
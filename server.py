@@ -1,10 +1,15 @@
 import os
 import json
+import time
 import uuid
 import sqlite3
 import asyncio
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import AsyncGenerator
+from functools import lru_cache
+from typing import AsyncGenerator, Optional
 
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
@@ -12,8 +17,9 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from sse_starlette.sse import EventSourceResponse
 from dotenv import load_dotenv
+import orjson
 
-from openai import OpenAI
+from openai import AsyncOpenAI
 from fastmcp import Client
 
 load_dotenv()
@@ -24,8 +30,31 @@ OPENAI_API_KEY = os.getenv("OpenRouterAPIKey")
 MCP_SERVER_URL = "http://localhost:8000/sse"
 MODEL_NAME = "xiaomi/mimo-v2-flash:free"#"moonshotai/kimi-k2-0905" not work #"x-ai/grok-4.1-fast"  work  "deepseek/deepseek-v3.2" work special not work  "minimax/minimax-m2" work "z-ai/glm-4.6v" work
 DB_FILE = "chat_history.db"
-
-app = FastAPI()
+TOOLS_CACHE_TTL = 300  # seconds to reuse the MCP tool schema before re-listing
+SERVE_STATIC = os.getenv("SERVE_STATIC", "1") != "0"  # set to 0 when a reverse proxy serves static/
+SSE_FLUSH_INTERVAL = 0.016  # seconds to collect stream events into one SSE frame
+SSE_FLUSH_BYTES = 4096  # flush a frame early once its payload reaches this size
+MESSAGES_PAGE_SIZE = 100  # default number of messages returned per history request
+MESSAGES_MAX_PAGE_SIZE = 500
+TOOL_MSG_CAP = 4000  # max chars of a tool result fed back to the Main Agent (full text is logged)
+LOG_QUEUE_SIZE = 10000  # pending log entries before new ones are dropped
+LOG_MAX_OPEN_FILES = 32  # per-session log handles kept open by the writer
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    # Flush queued session logs and close their files on shutdown
+    if _log_task is not None and not _log_task.done():
+        await LOG_Q.put(None)
+        await _log_task
+
+app = FastAPI(lifespan=lifespan)
+
+# Shared LLM client so connections to the provider are pooled across sessions.
+# Created on first use so a missing API key fails the chat stream, not the whole app.
+@lru_cache(maxsize=None)
+def get_llm_client():
+    return AsyncOpenAI(base_url=OPENAI_BASE_URL, api_key=OPENAI_API_KEY)
 
 # Enable CORS
 app.add_middleware(
@@ -38,80 +67,144 @@ app.add_middleware(
 
 # --- Database Management (SQLite) ---
 
+# One long-lived connection shared by all helpers (autocommit mode). Routes call the
+# helpers via asyncio.to_thread so SQLite never blocks the event loop; the lock
+# serializes the worker threads sharing the connection.
+DB_CONN = sqlite3.connect(DB_FILE, check_same_thread=False, isolation_level=None)
+DB_LOCK = threading.Lock()
+
 def init_db():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS sessions
-                 (id TEXT PRIMARY KEY, title TEXT, created_at TEXT, agent_notes TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS messages
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT, role TEXT, content TEXT, timestamp TEXT)''')
-    conn.commit()
-    conn.close()
+    with DB_LOCK:
+        # WAL lets readers proceed during writes; journal_mode persists in the DB file,
+        # the remaining PRAGMAs apply to this connection for its lifetime
+        DB_CONN.executescript("PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; PRAGMA temp_store=MEMORY; "
+                              "PRAGMA cache_size=-8000; PRAGMA mmap_size=268435456;")
+        DB_CONN.execute('''CREATE TABLE IF NOT EXISTS sessions
+                     (id TEXT PRIMARY KEY, title TEXT, created_at TEXT, agent_notes TEXT)''')
+        DB_CONN.execute('''CREATE TABLE IF NOT EXISTS messages
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT, role TEXT, content TEXT, timestamp TEXT)''')
+        # Covers get_messages_db's filter + ORDER BY as an index range scan
+        DB_CONN.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id, id)")
 
 def get_sessions_db():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT id, title, created_at FROM sessions ORDER BY created_at DESC")
-    sessions = [{"id": s[0], "title": s[1], "created_at": s[2]} for s in c.fetchall()]
-    conn.close()
-    return sessions
+    with DB_LOCK:
+        rows = DB_CONN.execute("SELECT id, title, created_at FROM sessions ORDER BY created_at DESC").fetchall()
+    return [{"id": s[0], "title": s[1], "created_at": s[2]} for s in rows]
 
 def create_session_db(first_message):
     session_id = str(uuid.uuid4())
     title = first_message[:30] + "..." if len(first_message) > 30 else first_message
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("INSERT INTO sessions (id, title, created_at, agent_notes) VALUES (?, ?, ?, ?)",
-              (session_id, title, datetime.now().isoformat(), "Initial State: Task just started."))
-    conn.commit()
-    conn.close()
+    with DB_LOCK:
+        DB_CONN.execute("INSERT INTO sessions (id, title, created_at, agent_notes) VALUES (?, ?, ?, ?)",
+                        (session_id, title, datetime.now().isoformat(), "Initial State: Task just started."))
     return session_id
 
-def get_messages_db(session_id):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT role, content FROM messages WHERE session_id = ? ORDER BY id ASC", (session_id,))
-    msgs = c.fetchall()
-    conn.close()
-    return [{"role": m[0], "content": m[1]} for m in msgs]
+def get_messages_db(session_id, limit=MESSAGES_PAGE_SIZE, before_id=None):
+    """Return up to `limit` most recent messages (optionally older than `before_id`), oldest first."""
+    with DB_LOCK:
+        if before_id is None:
+            msgs = DB_CONN.execute("SELECT id, role, content FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                                   (session_id, limit)).fetchall()
+        else:
+            msgs = DB_CONN.execute("SELECT id, role, content FROM messages WHERE session_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                                   (session_id, before_id, limit)).fetchall()
+    return [{"id": m[0], "role": m[1], "content": m[2]} for m in reversed(msgs)]
 
 def save_message_db(session_id, role, content):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("INSERT INTO messages (session_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
-              (session_id, role, content, datetime.now().isoformat()))
-    conn.commit()
-    conn.close()
+    with DB_LOCK:
+        DB_CONN.execute("INSERT INTO messages (session_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                        (session_id, role, content, datetime.now().isoformat()))
 
 def get_agent_notes_db(session_id):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT agent_notes FROM sessions WHERE id = ?", (session_id,))
-    result = c.fetchone()
-    conn.close()
+    with DB_LOCK:
+        result = DB_CONN.execute("SELECT agent_notes FROM sessions WHERE id = ?", (session_id,)).fetchone()
     return result[0] if result else "Initial State: Task just started."
 
-def update_agent_notes_db(session_id, new_notes):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("UPDATE sessions SET agent_notes = ? WHERE id = ?", (new_notes, session_id))
-    conn.commit()
-    conn.close()
+def save_turn_db(session_id, new_notes, messages):
+    """Persist the notes and (role, content) messages of one agent turn in a single transaction."""
+    timestamp = datetime.now().isoformat()
+    rows = [(session_id, role, content, timestamp) for role, content in messages]
+    with DB_LOCK:
+        DB_CONN.execute("BEGIN IMMEDIATE")
+        try:
+            DB_CONN.execute("UPDATE sessions SET agent_notes = ? WHERE id = ?", (new_notes, session_id))
+            DB_CONN.executemany("INSERT INTO messages (session_id, role, content, timestamp) VALUES (?, ?, ?, ?)", rows)
+            DB_CONN.execute("COMMIT")
+        except Exception:
+            DB_CONN.execute("ROLLBACK")
+            raise
 
 # Initialize DB on start
 init_db()
 
+# --- Session Logging (background writer) ---
+
+# Log lines are queued by the agent and written in batches by a single task,
+# which keeps recently used per-session files open (LRU) instead of reopening them.
+LOG_Q = asyncio.Queue(maxsize=LOG_QUEUE_SIZE)
+_log_task = None
+_log_handles = OrderedDict()
+
+def _write_log_batch(batch):
+    for path, line in batch:
+        fh = _log_handles.pop(path, None)
+        if fh is None:
+            fh = open(path, "a", encoding="utf-8")
+        _log_handles[path] = fh
+        if len(_log_handles) > LOG_MAX_OPEN_FILES:
+            _, oldest = _log_handles.popitem(last=False)
+            oldest.close()
+        fh.write(line)
+    for fh in _log_handles.values():
+        fh.flush()
+
+def _close_log_handles():
+    while _log_handles:
+        _, fh = _log_handles.popitem()
+        fh.close()
+
+async def _log_writer():
+    while True:
+        batch = [await LOG_Q.get()]
+        while not LOG_Q.empty():
+            batch.append(LOG_Q.get_nowait())
+        # None is the shutdown sentinel
+        stop = None in batch
+        batch = [item for item in batch if item is not None]
+        try:
+            await asyncio.to_thread(_write_log_batch, batch)
+        except Exception as e:
+            print(f"Failed to write to log file: {e}")
+        if stop:
+            await asyncio.to_thread(_close_log_handles)
+            return
+
+def enqueue_log(path, line):
+    global _log_task
+    if _log_task is None or _log_task.done():
+        _log_task = asyncio.create_task(_log_writer())
+    try:
+        LOG_Q.put_nowait((path, line))
+    except asyncio.QueueFull:
+        print(f"Log queue full, dropping entry for {path}")
+
 # --- The Compass Agent System (Logic Preserved) ---
 
+# OpenAI-format tool schema shared across agent runs (refreshed every TOOLS_CACHE_TTL)
+_TOOLS_CACHE = {"ts": 0.0, "schema": None}
+_TOOLS_LOCK = asyncio.Lock()
+
 class CompassSystem:
-    def __init__(self, mcp_session, current_notes, session_id, max_inner_steps=5, max_outer_loops=4):
-        self.client = OpenAI(base_url=OPENAI_BASE_URL, api_key=OPENAI_API_KEY)
+    available_tools = []
+
+    def __init__(self, mcp_session, current_notes, session_id, max_inner_steps=5, max_outer_loops=4, meta_interval=2):
+        self.client = get_llm_client()
         self.mcp_session = mcp_session
         self.notes = current_notes
-        self.available_tools = [] 
         self.session_id = session_id
         self.max_inner_steps = max_inner_steps
         self.max_outer_loops = max_outer_loops
+        self.meta_interval = meta_interval
         self.log_file = os.path.join("logs", f"{session_id}.log")
         
         # Ensure log directory exists
@@ -119,34 +212,36 @@ class CompassSystem:
 
     def _log_to_file(self, category, content):
         timestamp = datetime.now().isoformat()
-        try:
-            with open(self.log_file, "a", encoding="utf-8") as f:
-                f.write(f"[{timestamp}] [{category}]\n{content}\n{'-'*80}\n")
-        except Exception as e:
-            print(f"Failed to write to log file: {e}") 
+        enqueue_log(self.log_file, f"[{timestamp}] [{category}]\n{content}\n{'-'*80}\n")
 
     async def fetch_tools_for_openai(self):
-        try:
-            tools = await self.mcp_session.list_tools()
-            # Handle both fastmcp (list) and standard mcp (object with .tools)
-            if hasattr(tools, 'tools'):
-                tools = tools.tools
-                
-            openai_tools = []
-            for tool in tools:
-                openai_tools.append({
-                    "type": "function",
-                    "function": {
-                        "name": tool.name,
-                        "description": tool.description,
-                        "parameters": tool.inputSchema 
-                    }
-                })
-            self.available_tools = openai_tools
-            return openai_tools
-        except Exception as e:
-            print(f"Error fetching tools: {e}")
-            return []
+        async with _TOOLS_LOCK:
+            if _TOOLS_CACHE["schema"] and time.monotonic() - _TOOLS_CACHE["ts"] < TOOLS_CACHE_TTL:
+                self.available_tools = _TOOLS_CACHE["schema"]
+                return self.available_tools
+            try:
+                tools = await self.mcp_session.list_tools()
+                # Handle both fastmcp (list) and standard mcp (object with .tools)
+                if hasattr(tools, 'tools'):
+                    tools = tools.tools
+                    
+                openai_tools = []
+                for tool in tools:
+                    openai_tools.append({
+                        "type": "function",
+                        "function": {
+                            "name": tool.name,
+                            "description": tool.description,
+                            "parameters": tool.inputSchema 
+                        }
+                    })
+                _TOOLS_CACHE["schema"] = openai_tools
+                _TOOLS_CACHE["ts"] = time.monotonic()
+                self.available_tools = openai_tools
+                return openai_tools
+            except Exception as e:
+                print(f"Error fetching tools: {e}")
+                return []
 
     def log_stream(self, loop_type, role, content):
         """Yields log messages."""
@@ -160,7 +255,7 @@ class CompassSystem:
         })
 
     async def call_mcp_tool(self, tool_name, arguments):
-        self._log_to_file("MCP CALL", f"Function: {tool_name}\nArguments: {json.dumps(arguments, indent=2)}")
+        self._log_to_file("MCP CALL", f"Function: {tool_name}\nArguments: {json.dumps(arguments, separators=(',', ':'))}")
         try:
             result = await self.mcp_session.call_tool(name=tool_name, arguments=arguments)
             text_content = ""
@@ -180,7 +275,7 @@ class CompassSystem:
         except Exception as e:
             return f"Error calling {tool_name}: {str(e)}"
 
-    def synthesize_context_for_agent(self, query, meta_signal=None):
+    async def synthesize_context_for_agent(self, query, meta_signal=None):
         prompt = (
             "You are the Context Manager. Synthesize a concise, execution-ready context for the Main Agent.\n"
             "Focus strictly on the IMMEDIATE next steps based on the strategic signal.\n\n"
@@ -197,14 +292,14 @@ class CompassSystem:
             "4. Next Plan: 2-3 concrete steps for the Main Agent to execute NOW."
         )
         self._log_to_file("AGENT PROMPT (Context Manager)", prompt)
-        response = self.client.chat.completions.create(
+        response = await self.client.chat.completions.create(
             model=MODEL_NAME, messages=[{"role": "user", "content": prompt}]
         )
         content = response.choices[0].message.content
         self._log_to_file("AGENT OUTPUT (Context Manager)", content)
         return content
 
-    def update_notes_logic(self, query, trajectory, meta_data):
+    async def update_notes_logic(self, query, trajectory, meta_data):
         prompt = (
             "You are the Context Manager. Update the global Research Notes.\n"
             "CRITICAL INSTRUCTION: If the Recent Trajectory contains the final answers, "
@@ -216,12 +311,12 @@ class CompassSystem:
             "Return ONLY the updated text of the Notes."
         )
         self._log_to_file("AGENT PROMPT (Context Manager - Update Notes)", prompt)
-        response = self.client.chat.completions.create(model=MODEL_NAME, messages=[{"role": "user", "content": prompt}])
+        response = await self.client.chat.completions.create(model=MODEL_NAME, messages=[{"role": "user", "content": prompt}])
         self.notes = response.choices[0].message.content
         self._log_to_file("AGENT OUTPUT (Context Manager - Update Notes)", self.notes)
         return self.notes
 
-    def meta_think(self, current_brief, current_trajectory):
+    async def meta_think(self, current_brief, current_trajectory):
         prompt = (
             "You are the Meta-Thinker. Decide execution flow.\n"
             f"--- CURRENT CONTEXT ---\n{current_brief}\n\n"
@@ -230,7 +325,7 @@ class CompassSystem:
         )
         self._log_to_file("AGENT PROMPT (Meta-Thinker)", prompt)
         try:
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=MODEL_NAME, 
                 messages=[{"role": "user", "content": prompt}],
                 response_format={"type": "json_object"}
@@ -238,17 +333,17 @@ class CompassSystem:
             content = response.choices[0].message.content
             self._log_to_file("AGENT OUTPUT (Meta-Thinker)", content)
             return json.loads(content)
-        except:
+        except Exception:
             return {"decision": "INTERRUPT", "reason": "JSON Error", "strategic_signal": "Error parsing meta response."}
 
-    def extract_final_answer(self, query):
+    async def extract_final_answer(self, query):
         prompt = (
             "You are the Answer Synthesizer. Formulate a final answer based on notes.\n"
             f"--- USER QUERY ---\n{query}\n\n"
             f"--- VERIFIED RESEARCH NOTES ---\n{self.notes}\n"
         )
         self._log_to_file("AGENT PROMPT (Answer Synthesizer)", prompt)
-        response = self.client.chat.completions.create(model=MODEL_NAME, messages=[{"role": "user", "content": prompt}])
+        response = await self.client.chat.completions.create(model=MODEL_NAME, messages=[{"role": "user", "content": prompt}])
         content = response.choices[0].message.content
         self._log_to_file("AGENT OUTPUT (Answer Synthesizer)", content)
         return content
@@ -265,14 +360,15 @@ class CompassSystem:
         
         trajectory_log = ""
         tools_schema = self.available_tools if self.available_tools else None
+        logged_upto = 0  # messages[:logged_upto] are already in the log file
 
         for i in range(self.max_inner_steps):
             yield self.log_stream("INNER", f"Main Agent (Step {i+1})", "Thinking...")
             
-            # --- FIX STARTS HERE ---
-            # Helper to sanitize messages for logging (converts Objects to Dicts)
+            # Helper to sanitize messages for logging (converts Objects to Dicts).
+            # Only messages appended since the last step are serialized.
             serializable_msgs = []
-            for m in messages:
+            for m in messages[logged_upto:]:
                 if isinstance(m, dict):
                     serializable_msgs.append(m)
                 elif hasattr(m, 'model_dump'): # OpenAI V1+ objects
@@ -282,42 +378,77 @@ class CompassSystem:
                 else:
                     serializable_msgs.append(str(m))
             
-            self._log_to_file("AGENT PROMPT (Main Agent)", json.dumps(serializable_msgs, indent=2))
+            logged_upto = len(messages)
+            self._log_to_file("AGENT PROMPT (Main Agent - New Messages)", json.dumps(serializable_msgs, separators=(",", ":")))
             
             if tools_schema:
-                response = self.client.chat.completions.create(
-                    model=MODEL_NAME, messages=messages, tools=tools_schema
+                stream = await self.client.chat.completions.create(
+                    model=MODEL_NAME, messages=messages, tools=tools_schema, stream=True
                 )
             else:
-                response = self.client.chat.completions.create(
-                    model=MODEL_NAME, messages=messages
+                stream = await self.client.chat.completions.create(
+                    model=MODEL_NAME, messages=messages, stream=True
                 )
-            
-            self._log_to_file("AGENT OUTPUT (Main Agent)", response.choices[0].message.content or "Tool Call")
 
-            msg = response.choices[0].message
+            # Forward content tokens as they arrive and rebuild tool calls from their deltas
+            content = ""
+            tool_calls = {}
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    content += delta.content
+                    yield json.dumps({"type": "token", "content": delta.content})
+                for tc_delta in delta.tool_calls or []:
+                    tc = tool_calls.setdefault(tc_delta.index, {
+                        "id": "", "type": "function", "function": {"name": "", "arguments": ""}
+                    })
+                    if tc_delta.id:
+                        tc["id"] = tc_delta.id
+                    if tc_delta.function:
+                        if tc_delta.function.name:
+                            tc["function"]["name"] += tc_delta.function.name
+                        if tc_delta.function.arguments:
+                            tc["function"]["arguments"] += tc_delta.function.arguments
+
+            self._log_to_file("AGENT OUTPUT (Main Agent)", content or "Tool Call")
+
+            msg = {"role": "assistant", "content": content or None}
+            if tool_calls:
+                msg["tool_calls"] = [tool_calls[idx] for idx in sorted(tool_calls)]
             messages.append(msg)
             
             step_desc = ""
+            tool_error = False
             
-            if msg.tool_calls:
-                for tc in msg.tool_calls:
-                    args = json.loads(tc.function.arguments)
-                    tool_name = tc.function.name
+            if tool_calls:
+                for tc in msg["tool_calls"]:
+                    args = json.loads(tc["function"]["arguments"] or "{}")
+                    tool_name = tc["function"]["name"]
                     step_desc += f"Action: {tool_name}({args})\n"
                     yield self.log_stream("INNER", "Tool Call", f"{tool_name}: {args}")
                     
                     res = await self.call_mcp_tool(tool_name, args)
+                    if res.startswith(("TOOL ERROR", "Error calling")):
+                        tool_error = True
                     short_res = (res[:200] + '...') if len(res) > 200 else res
                     yield self.log_stream("INNER", "Tool Result", f"{short_res}")
-                    messages.append({"role": "tool", "tool_call_id": tc.id, "content": res})
+                    truncated = res if len(res) <= TOOL_MSG_CAP else res[:TOOL_MSG_CAP] + f"\n...[truncated {len(res) - TOOL_MSG_CAP} chars]"
+                    messages.append({"role": "tool", "tool_call_id": tc["id"], "content": truncated})
                     step_desc += f"Observation: {short_res}\n"
             else:
-                step_desc += f"Thought: {msg.content}\n"
-                yield self.log_stream("INNER", "Thought", msg.content)
+                # The thought itself was already streamed to the UI token by token
+                step_desc += f"Thought: {content}\n"
             
             trajectory_log += f"Step {i+1}: {step_desc}\n"
-            meta_data = self.meta_think(context_brief, trajectory_log)
+
+            # Skip the Meta-Thinker only between tool-call steps: it still runs every meta_interval
+            # steps, after tool errors, on the last step, and when the agent answered without a tool
+            if tool_calls and (i + 1) % self.meta_interval != 0 and not tool_error and i != self.max_inner_steps - 1:
+                continue
+
+            meta_data = await self.meta_think(context_brief, trajectory_log)
             decision = meta_data.get('decision', 'CONTINUE')
             signal = meta_data.get('strategic_signal', 'None')
             yield self.log_stream("INNER", "Meta-Thinker", f"**{decision}**: {signal}")
@@ -338,7 +469,7 @@ class CompassSystem:
 
         for t in range(self.max_outer_loops):
             yield self.log_stream("OUTER", f"Loop {t+1}", "Synthesizing Context...")
-            current_context = self.synthesize_context_for_agent(query, last_meta_signal)
+            current_context = await self.synthesize_context_for_agent(query, last_meta_signal)
             yield self.log_stream("OUTER", "Context Brief", current_context)
 
             trajectory = ""
@@ -351,11 +482,11 @@ class CompassSystem:
                     yield log_entry
 
             yield self.log_stream("OUTER", "Memory Update", f"Integrating findings... Decision: {meta_data.get('decision')}")
-            self.update_notes_logic(query, trajectory, meta_data)
+            await self.update_notes_logic(query, trajectory, meta_data)
             
             if meta_data.get('decision') == 'COMPLETED':
                 yield self.log_stream("SYSTEM", "Completion", "Generating final answer...")
-                final_answer = self.extract_final_answer(query)
+                final_answer = await self.extract_final_answer(query)
                 yield json.dumps({
                     "type": "final_answer",
                     "content": final_answer
@@ -370,24 +501,84 @@ class CompassSystem:
             "content": final_msg
         })
 
+# --- SSE Batching ---
+
+async def batch_events(source, interval=SSE_FLUSH_INTERVAL, max_bytes=SSE_FLUSH_BYTES):
+    """
+    Pack (event_json, urgent) items from `source` into SSE payloads holding a JSON array.
+    A frame is flushed after `interval` seconds, once it reaches `max_bytes`, or right
+    after an urgent item. Order is preserved and errors from `source` are re-raised.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for item in source:
+                await queue.put((item, None))
+            await queue.put((None, None))
+        except Exception as e:
+            await queue.put((None, e))
+
+    task = asyncio.create_task(pump())
+    try:
+        batch, size, deadline = [], 0, None
+        while True:
+            try:
+                timeout = max(0.0, deadline - loop.time()) if batch else None
+                item, error = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                yield "[" + ",".join(batch) + "]"
+                batch, size = [], 0
+                continue
+
+            if item is None:
+                if batch:
+                    yield "[" + ",".join(batch) + "]"
+                if error:
+                    raise error
+                return
+
+            event_json, urgent = item
+            if not batch:
+                deadline = loop.time() + interval
+            batch.append(event_json)
+            size += len(event_json)
+            if urgent or size >= max_bytes:
+                yield "[" + ",".join(batch) + "]"
+                batch, size = [], 0
+    finally:
+        # Wait for the agent to actually stop so it is done before the caller
+        # tears down the MCP session it is using
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
 # --- API Routes ---
 
+class OrjsonResponse(JSONResponse):
+    """JSONResponse rendered with orjson (FastAPI's own ORJSONResponse is deprecated)."""
+    def render(self, content):
+        return orjson.dumps(content)
+
 @app.get("/api/sessions")
 async def get_sessions_route():
-    return get_sessions_db()
+    return await asyncio.to_thread(get_sessions_db)
 
 @app.post("/api/sessions")
 async def create_session_route(request: Request):
     data = await request.json()
     first_msg = data.get("message", "New Chat")
-    session_id = create_session_db(first_msg)
+    session_id = await asyncio.to_thread(create_session_db, first_msg)
     # Save the initial user message
-    save_message_db(session_id, "user", first_msg)
+    await asyncio.to_thread(save_message_db, session_id, "user", first_msg)
     return {"id": session_id}
 
-@app.get("/api/sessions/{session_id}/messages")
-async def get_messages_route(session_id: str):
-    return get_messages_db(session_id)
+@app.get("/api/sessions/{session_id}/messages", response_class=OrjsonResponse)
+async def get_messages_route(session_id: str, limit: int = MESSAGES_PAGE_SIZE, before_id: Optional[int] = None):
+    limit = max(1, min(limit, MESSAGES_MAX_PAGE_SIZE))
+    # Returning the response directly skips FastAPI's jsonable_encoder pass over every row;
+    # response_class above only documents the media type
+    return OrjsonResponse(await asyncio.to_thread(get_messages_db, session_id, limit, before_id))
 
 @app.get("/api/chat_stream")
 async def chat_stream(session_id: str, query: str):
@@ -396,7 +587,7 @@ async def chat_stream(session_id: str, query: str):
     """
     async def event_generator():
         # 1. Retrieve notes
-        current_notes = get_agent_notes_db(session_id)
+        current_notes = await asyncio.to_thread(get_agent_notes_db, session_id)
         
         # 2. Connect to MCP
         try:
@@ -404,28 +595,42 @@ async def chat_stream(session_id: str, query: str):
                 agent = CompassSystem(mcp_client, current_notes, session_id)
                 
                 # 3. Run Agent Loop
-
-                async for update_json in agent.solve(query):
-                    yield {"data": update_json}
-                    
-                    # Check if it's the final answer to save it
-                    data = json.loads(update_json)
-                    if data["type"] == "final_answer":
-                        final_answer = data["content"]
-                
-                # 4. Update DB
-                update_agent_notes_db(session_id, agent.notes)
-                save_message_db(session_id, "assistant", final_answer)
+                async def updates():
+                    async for update_json in agent.solve(query):
+                        data = json.loads(update_json)
+                        if data["type"] == "final_answer":
+                            # 4. Update DB (one transaction per turn) before the answer is sent:
+                            # the client closes the stream as soon as it receives it
+                            await asyncio.to_thread(save_turn_db, session_id, agent.notes,
+                                                    [("assistant", data["content"])])
+                        # The final answer is flushed unbatched
+                        yield update_json, data["type"] == "final_answer"
+
+                # Log lines and tokens are packed into one SSE frame per flush
+                async for frame_json in batch_events(updates()):
+                    yield {"data": frame_json}
                     
         except Exception as e:
             err_msg = json.dumps({"type": "error", "content": str(e)})
             yield {"data": err_msg}
 
+    # sse-starlette already sends Cache-Control: no-store, Connection: keep-alive and
+    # X-Accel-Buffering: no, so reverse proxies forward the stream unbuffered
     return EventSourceResponse(event_generator())
 
-# Mount static files (Frontend)
-app.mount("/", StaticFiles(directory="static", html=True), name="static")
+# Mount static files (Frontend) unless they are served by a reverse proxy
+if SERVE_STATIC:
+    app.mount("/", StaticFiles(directory="static", html=True), name="static")
 
 if __name__ == "__main__":
+    import sys
     import uvicorn
-    uvicorn.run("server:app", host="0.0.0.0", port=8501, reload=True)
\ No newline at end of file
+    # Reload is for development only and cannot be combined with multiple workers
+    reload = os.getenv("UVICORN_RELOAD") == "1"
+    uvicorn.run(
+        "server:app", host="0.0.0.0", port=8501,
+        loop="asyncio" if sys.platform == "win32" else "uvloop",  # uvloop does not support Windows
+        http="httptools",
+        workers=1 if reload else int(os.getenv("UVICORN_WORKERS", "4")),
+        reload=reload,
+    )
\ No newline at end of file
@@ -1,5 +1,6 @@
 let currentSessionId = null;
 const API_BASE = '/api';
+const MESSAGES_PAGE_SIZE = 100;
 
 const chatContainer = document.getElementById('chat-container');
 const sessionList = document.getElementById('session-list');
@@ -37,16 +38,39 @@ async function loadMessages(sessionId) {
     const activeItem = document.querySelector(`.session-item[data-id="${sessionId}"]`);
     if (activeItem) activeItem.classList.add('active');
 
-    const res = await fetch(`${API_BASE}/sessions/${sessionId}/messages`);
+    const res = await fetch(`${API_BASE}/sessions/${sessionId}/messages?limit=${MESSAGES_PAGE_SIZE}`);
     const messages = await res.json();
 
     messages.forEach(msg => {
         // For historical messages, we assume no logs are stored (just the final markdown)
         appendSimpleMessage(msg.role, msg.content);
     });
+    renderLoadOlderButton(sessionId, messages);
     scrollToBottom();
 }
 
+// History is paginated: a full page means there may be older messages to fetch
+function renderLoadOlderButton(sessionId, messages) {
+    if (messages.length < MESSAGES_PAGE_SIZE) return;
+
+    const btn = document.createElement('button');
+    btn.className = 'btn-primary';
+    btn.textContent = 'Load earlier messages';
+    btn.onclick = async () => {
+        const res = await fetch(`${API_BASE}/sessions/${sessionId}/messages?limit=${MESSAGES_PAGE_SIZE}&before_id=${messages[0].id}`);
+        const older = await res.json();
+        if (sessionId !== currentSessionId) return;
+
+        btn.remove();
+        const anchor = chatContainer.firstChild;
+        older.forEach(msg => {
+            chatContainer.insertBefore(buildSimpleMessage(msg.role, msg.content), anchor);
+        });
+        renderLoadOlderButton(sessionId, older);
+    };
+    chatContainer.prepend(btn);
+}
+
 // --- UI Logic ---
 
 function renderSessionList(sessions) {
@@ -62,7 +86,7 @@ function renderSessionList(sessions) {
 }
 
 // Used for loading history (simple text bubbles)
-function appendSimpleMessage(role, content) {
+function buildSimpleMessage(role, content) {
     const div = document.createElement('div');
     div.className = `message ${role}`;
 
@@ -72,8 +96,11 @@ function appendSimpleMessage(role, content) {
     } else {
         div.innerHTML = marked.parse(content);
     }
+    return div;
+}
 
-    chatContainer.appendChild(div);
+function appendSimpleMessage(role, content) {
+    chatContainer.appendChild(buildSimpleMessage(role, content));
     const welcome = document.querySelector('.welcome-msg');
     if (welcome) welcome.remove();
 }
@@ -143,15 +170,33 @@ async function handleSend() {
     // Create the structure: [ Message [ Details [ Logs ] ] [ Answer ] ]
     const streamUI = createStreamingMessage();
     let accumulatedAnswer = ""; // Buffer for Markdown
+    let tokenEntry = null; // Log entry currently receiving streamed tokens
 
     // 3. Start Event Source
     const startTime = Date.now();
     const eventSource = new EventSource(`${API_BASE}/chat_stream?session_id=${currentSessionId}&query=${encodeURIComponent(query)}`);
 
+    // The server packs several events into one frame as a JSON array
     eventSource.onmessage = (event) => {
-        const data = JSON.parse(event.data);
+        const payload = JSON.parse(event.data);
+        (Array.isArray(payload) ? payload : [payload]).forEach(handleStreamEvent);
+    };
+
+    const handleStreamEvent = (data) => {
+        if (data.type === 'token') {
+            // Append streamed tokens to the current Main Agent entry
+            if (!tokenEntry) {
+                const entry = document.createElement('div');
+                entry.className = 'log-entry';
+                entry.innerHTML = '<span class="log-tag">[INNER] Main Agent</span> <span class="log-content"></span>';
+                streamUI.logsContainer.appendChild(entry);
+                tokenEntry = entry.querySelector('.log-content');
+            }
+            tokenEntry.textContent += data.content;
+            streamUI.logsContainer.scrollTop = streamUI.logsContainer.scrollHeight;
 
-        if (data.type === 'log') {
+        } else if (data.type === 'log') {
+            tokenEntry = null;
             // Append Log Entry
             const entry = document.createElement('div');
             entry.className = 'log-entry';